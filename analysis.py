@@ -1,9 +1,17 @@
+import argparse
+import math
 import os
+import time
+
+import torch
 
 from train import load_corpus
 from flair.models import SequenceTagger
 from flair.datasets import DataLoader, FlairDatapointDataset
-from scorer import Scorer
+from scorer import Scorer, ScorerCache
+from embedding_store import sentence_hash
+from embedding_store import PrecomputedEmbeddings
+from scorer_state import tags_from_mentions, write_dump
 from flair.data import Sentence
 from tqdm import tqdm
 
@@ -18,10 +26,42 @@ import seaborn as sns
 
 import pickle
 
-def predict(data_points, model, batch_size, force_token_labels=False):
+def quantize_model(model):
+    """Returns a CPU copy of the tagger with its own LSTM and reprojection layer dynamically quantized to int8."""
+    if getattr(model, "is_quantized", False):
+        return model
+    model.to(torch.device("cpu"))
+    # only the tagger's own hidden layers: the embedding language models must keep producing the
+    # features the tagger was trained on, and flair reads the output projection's weight dtype
+    layers = {name: torch.quantization.default_dynamic_qconfig for name in ("rnn", "embedding2nn") if hasattr(model, name)}
+    quantized = torch.quantization.quantize_dynamic(model, layers, dtype=torch.qint8)
+    quantized.is_quantized = True
+    return quantized
+
+
+def predict(data_points, model, batch_size, force_token_labels=False, embedding_store=None):
 
     # this is based on Flair's prediction method for their sequence tagger
-    sentences = [sentence for sentence in data_points]
+    all_sentences = [sentence for sentence in data_points]
+
+    # only predict each unique token sequence once, tweets are often repeated
+    unique = {}
+    duplicates = []
+    for sentence in all_sentences:
+        key = sentence_hash(sentence)
+        if key in unique:
+            duplicates.append((sentence, unique[key]))
+        else:
+            unique[key] = sentence
+    sentences = list(unique.values())
+
+    # serve embeddings from the precomputed store instead of running the LMs
+    if embedding_store is not None:
+        if not isinstance(model.embeddings, PrecomputedEmbeddings):
+            model.embeddings = PrecomputedEmbeddings(model.embeddings, embedding_store)
+        elif model.embeddings.store_path != embedding_store:
+            # a model trained by the sweep still points at the store of the machine it was trained on
+            model.embeddings.set_store(embedding_store)
 
     dataloader = DataLoader(
         dataset=FlairDatapointDataset(sentences),
@@ -34,21 +74,107 @@ def predict(data_points, model, batch_size, force_token_labels=False):
             sentence.remove_labels('ner') # remove existing labels
         model.predict(batch, force_token_predictions=force_token_labels) # predict on the batch of sentences
 
-    return sentences
+    # copy the predictions to the duplicates that were skipped
+    for duplicate, original in duplicates:
+        duplicate.remove_labels('ner')
+        copy_labels(original, duplicate, 'ner')
+
+    total = len(unique) + len(duplicates)
+    if total:
+        print(f"Prediction cache: {len(unique)} unique of {total} sentences, hit rate {len(duplicates) / total * 100:0.2f}%")
+
+    return all_sentences
+
+
+def copy_labels(source, target, label_type):
+    """Adds the source sentence's labels to the same tokens of an identical target sentence."""
+    for label in source.get_labels(label_type):
+        data_point = label.data_point
+        if data_point is source:
+            target.add_label(label_type, label.value, label.score)
+        elif hasattr(data_point, 'tokens'):
+            start = data_point.tokens[0].idx - 1
+            end = data_point.tokens[-1].idx
+            target[start:end].add_label(label_type, label.value, label.score)
+        else:
+            target[data_point.idx - 1].add_label(label_type, label.value, label.score)
 
 
-def scorer_evaluate(reference, predictions):
+def scorer_evaluate(reference, predictions, cache_size=4096, families=None):
     print("Evaluating...")
-    scores = Scorer([], [])
-    for reference, prediction in zip(reference, predictions):
+    scores = Scorer([], [], families=families) # only the selected metric families are computed
+    cache = ScorerCache(maxsize=cache_size)
+    for sentence_id, (reference, prediction) in enumerate(zip(reference, predictions)):
         scores.merge(
-            Scorer(
+            cache.score(
                 Scorer.create_mentions(reference.get_labels()), 
                 Scorer.create_mentions(prediction.get_labels())
-                )
+                ),
+            sentence_id=sentence_id
             )
+    print(f"Scorer cache: {cache.hits} hits, {cache.misses} misses, hit rate {cache.hit_rate() * 100:0.2f}%")
     return scores
 
+def compare_inference(model, batch_size, tolerance=0.01, split="dev", embedding_store=None):
+    """
+    Predicts the split with the fp32 and the int8 model, reports latency and throughput side by side,
+    and fails if exact or partial F1 of the int8 model drops by more than the tolerance.
+    Returns the quantized model.
+    """
+    quantized = quantize_model(model)
+
+    # one untimed batch per model first, so neither timing includes lazy setup or cold caches
+    warmup = list(getattr(load_corpus(), split))[:batch_size]
+    for path_model in (model, quantized):
+        predict(data_points=warmup, model=path_model, batch_size=batch_size, embedding_store=embedding_store)
+
+    rows = []
+    for name, path_model in (("fp32", model), ("int8", quantized)):
+        # predict on a fresh copy of the split, since predicting replaces the gold labels
+        sentences = getattr(load_corpus(), split)
+        start = time.perf_counter()
+        predictions = predict(data_points=sentences, model=path_model, batch_size=batch_size, embedding_store=embedding_store)
+        seconds = time.perf_counter() - start
+        scores = scorer_evaluate(getattr(load_corpus(), split), predictions, families=("exact", "overlap"))
+        rows.append({
+            'Model': name,
+            'Seconds': seconds,
+            'Sentences/sec': len(predictions) / seconds if seconds > 0 else 0.0,
+            'ms/sentence': 1000 * seconds / len(predictions) if predictions else 0.0,
+            'Exact F1': scores.f1_score(),
+            'Partial F1': scores.partial_match_f1()
+        })
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False, float_format=lambda value: f"{value:0.4f}"))
+
+    check_quantized_scores(*rows, tolerance=tolerance, split=split)
+    return quantized
+
+def check_quantized_scores(fp32, int8, tolerance, split="dev"):
+    """Raises if the int8 exact or partial F1 is more than the tolerance below the fp32 one."""
+    for metric in ('Exact F1', 'Partial F1'):
+        drop = fp32[metric] - int8[metric]
+        # a drop of exactly the tolerance passes, even when the subtraction rounds just above it
+        if drop > tolerance and not math.isclose(drop, tolerance):
+            raise RuntimeError(
+                f"Quantized model {metric} dropped from {fp32[metric]:0.4f} to {int8[metric]:0.4f} on {split}, "
+                f"more than the tolerance of {tolerance}"
+            )
+
+def write_prediction_dump(reference, predictions, path):
+    """Writes gold and predicted BIO tags side by side for sharded scoring with scorer_state.py."""
+    sentences = []
+    for sentence_id, (reference, prediction) in enumerate(zip(reference, predictions)):
+        tokens = [token.text for token in reference]
+        sentences.append((
+            sentence_id,
+            tokens,
+            tags_from_mentions(len(tokens), Scorer.create_mentions(reference.get_labels())),
+            tags_from_mentions(len(tokens), Scorer.create_mentions(prediction.get_labels()))
+        ))
+    write_dump(path, sentences)
+
 def generate_visualizations(scores, output_dir="charts", dataset_name=""):
     """Generates and saves bar charts of the evaluation metrics."""
     print(f"Generating visualizations for '{dataset_name}' in {output_dir}...")
@@ -214,6 +340,11 @@ def generate_comparison_visualization(dev_scores, test_scores, output_dir="compa
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the trained tagger on dev and test with Scorer.")
+    parser.add_argument("--quantize", action="store_true", help="predict with an int8 dynamically quantized model")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="largest allowed F1 drop of the quantized model on dev")
+    args = parser.parse_args()
+
     # load corpus
     corpus = load_corpus()
 
@@ -227,8 +358,15 @@ if __name__ == "__main__":
         raise FileNotFoundError(f"Model file not found at {model_path}")
     model = SequenceTagger.load(model_path)
 
+    # use embeddings precomputed by train.ipynb if they are available
+    embedding_store = "embeddings" if os.path.isdir("embeddings") else None
+
+    # check the quantized model against the full model on dev before using it
+    if args.quantize:
+        model = compare_inference(model, batch_size=32, tolerance=args.tolerance, embedding_store=embedding_store)
+
     # evaluate with our Scorer
-    predictions = predict(data_points=corpus.dev, model=model, batch_size=32)   
+    predictions = predict(data_points=corpus.dev, model=model, batch_size=32, embedding_store=embedding_store)   
 
     # re-tagging the sentences means we lose the original dev tags
     # reload the corpus, relatively fast
@@ -241,6 +379,8 @@ if __name__ == "__main__":
     scores.write_partial_matches("predictions/partial_dev_overlap.csv", match_type="overlap")
     scores.write_partial_matches("predictions/partial_dev_left_bound.csv", match_type="left")
     scores.write_partial_matches("predictions/partial_dev_right_bound.csv", match_type="right")
+    scores.build_index("predictions/partial_dev_index.pkl")
+    write_prediction_dump(corpus.dev, predictions, "predictions/dev_dump.tsv")
 
     generate_visualizations(scores, output_dir="dev_charts", dataset_name="dev") 
 
@@ -255,7 +395,7 @@ if __name__ == "__main__":
     print(result.detailed_results)
 
     # repeat this process on the test set
-    test_predictions = predict(data_points=corpus.test, model=model, batch_size=32)
+    test_predictions = predict(data_points=corpus.test, model=model, batch_size=32, embedding_store=embedding_store)
     corpus = load_corpus()
     test_scores = scorer_evaluate(corpus.test, test_predictions)
     test_scores.print_score_report()
@@ -268,6 +408,8 @@ if __name__ == "__main__":
     test_scores.write_partial_matches("predictions/partial_test_overlap.csv", match_type="overlap")
     test_scores.write_partial_matches("predictions/partial_test_left_bound.csv", match_type="left")
     test_scores.write_partial_matches("predictions/partial_test_right_bound.csv", match_type="right")
+    test_scores.build_index("predictions/partial_test_index.pkl")
+    write_prediction_dump(corpus.test, test_predictions, "predictions/test_dump.tsv")
 
     generate_visualizations(test_scores, output_dir="test_charts", dataset_name="test")
     
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+import flair
+from flair.data import Corpus, Sentence
+from flair.embeddings import StackedEmbeddings, TokenEmbeddings
+from flair.embeddings.base import load_embeddings, register_embeddings
+
+
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.npy"
+# where a loaded model looks for its store when the path it was trained with does not exist here
+DEFAULT_STORE_PATH = "embeddings"
+
+
+def sentence_hash(sentence: Sentence) -> str:
+    """
+    Hash of the token sequence of a sentence, used as the key into the store.
+    """
+    tokens = "\n".join(token.text for token in sentence)
+    return hashlib.sha1(tokens.encode("utf8")).hexdigest()
+
+
+def embedding_config_key(embeddings: TokenEmbeddings) -> str:
+    """
+    Short hash identifying the embedding configuration (names and vector length),
+    so vectors from different embedding stacks never get mixed up.
+    """
+    config = {"names": embeddings.get_names(), "length": embeddings.embedding_length, "layout": "sorted"}
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf8")).hexdigest()[:12]
+
+
+def _sub_embeddings(embeddings: TokenEmbeddings) -> List[Tuple[str, int]]:
+    """
+    (name, length) of each embedding in the order their blocks are laid out in the store.
+    This is sorted by name, the order flair concatenates a token's embeddings in, not stack order.
+    """
+    if isinstance(embeddings, StackedEmbeddings):
+        sub_embeddings = [(embedding.name, embedding.embedding_length) for embedding in embeddings.embeddings]
+    else:
+        sub_embeddings = [(embeddings.name, embeddings.embedding_length)]
+    return sorted(sub_embeddings)
+
+
+class EmbeddingStore:
+    """
+    Memory-mapped on-disk store of token embeddings, keyed by sentence hash.
+    Each embedding configuration lives in its own subdirectory of the store path.
+    """
+
+    def __init__(self, path: str, embeddings: TokenEmbeddings) -> None:
+        self.config_key = embedding_config_key(embeddings)
+        self.path = os.path.join(path, self.config_key)
+        self.index: Dict[str, Tuple[int, int]] = {}
+        self.vectors: Optional[np.ndarray] = None
+
+        if os.path.isfile(os.path.join(self.path, INDEX_FILE)):
+            with open(os.path.join(self.path, INDEX_FILE), encoding="utf8") as file:
+                self.index = {key: tuple(value) for key, value in json.load(file).items()}
+            self.vectors = np.load(os.path.join(self.path, VECTORS_FILE), mmap_mode="r")
+
+    def __contains__(self, sentence: Sentence) -> bool:
+        return sentence_hash(sentence) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def lookup(self, sentence: Sentence) -> Optional[np.ndarray]:
+        """
+        Returns the (num_tokens, embedding_length) array for the sentence, or None if missing.
+        """
+        entry = self.index.get(sentence_hash(sentence))
+        if entry is None or self.vectors is None:
+            return None
+        offset, length = entry
+        return self.vectors[offset:offset + length]
+
+    @staticmethod
+    def build(sentences: Iterable[Sentence], embeddings: TokenEmbeddings, path: str, batch_size: int = 32) -> "EmbeddingStore":
+        """
+        Embeds every unique sentence once and writes the vectors to a memory-mapped store.
+        Overwrites any existing store for the same embedding configuration.
+        """
+        unique: Dict[str, Sentence] = {}
+        for sentence in sentences:
+            unique.setdefault(sentence_hash(sentence), sentence)
+
+        index = {}
+        offset = 0
+        for key, sentence in unique.items():
+            index[key] = (offset, len(sentence))
+            offset += len(sentence)
+
+        store_path = os.path.join(path, embedding_config_key(embeddings))
+        os.makedirs(store_path, exist_ok=True)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(store_path, VECTORS_FILE),
+            mode="w+",
+            dtype=np.float32,
+            shape=(offset, embeddings.embedding_length)
+        )
+
+        print("Precomputing embeddings...")
+        sub_embeddings = _sub_embeddings(embeddings)
+        items = list(unique.items())
+        for i in range(0, len(items), batch_size):
+            batch = [sentence for _, sentence in items[i:i + batch_size]]
+            embeddings.embed(batch)
+            for key, sentence in items[i:i + batch_size]:
+                start, length = index[key]
+                for j, token in enumerate(sentence):
+                    # one column block per embedding name, in the layout order read back below
+                    vectors[start + j] = torch.cat([token.get_embedding([name]) for name, _ in sub_embeddings]).cpu().numpy()
+                sentence.clear_embeddings()
+        vectors.flush()
+        del vectors
+
+        with open(os.path.join(store_path, INDEX_FILE), mode="w", encoding="utf8") as file:
+            json.dump(index, file)
+
+        return EmbeddingStore(path, embeddings)
+
+
+@register_embeddings
+class PrecomputedEmbeddings(TokenEmbeddings):
+    """
+    Wraps an embedding stack and serves its vectors from an EmbeddingStore.
+    Sentences missing from the store fall back to the wrapped embeddings, so a model
+    trained with this wrapper still works if the store is gone.
+    """
+
+    def __init__(self, embeddings: TokenEmbeddings, store_path: str) -> None:
+        super().__init__()
+        self.embeddings = embeddings
+        self.set_store(store_path)
+        self.name = f"precomputed-{self.store.config_key}"
+        self.static_embeddings = True
+        self.hits = 0
+        self.misses = 0
+
+    def set_store(self, store_path: str) -> None:
+        """
+        Points the wrapper at another store, e.g. the local copy on the machine a saved model is loaded on.
+        """
+        self.store_path = store_path
+        self.store = EmbeddingStore(store_path, self.embeddings)
+
+    @property
+    def embedding_length(self) -> int:
+        return self.embeddings.embedding_length
+
+    def get_names(self) -> List[str]:
+        # tokens carry the wrapped embeddings' names so downstream models see identical inputs
+        return self.embeddings.get_names()
+
+    def _everything_embedded(self, data_points: Sequence[Sentence]) -> bool:
+        # tokens carry the wrapped names rather than this wrapper's name
+        names = self.get_names()
+        return all(name in token._embeddings for sentence in data_points for token in sentence for name in names)
+
+    def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
+        missing = []
+        sub_embeddings = _sub_embeddings(self.embeddings)
+        for sentence in sentences:
+            vectors = self.store.lookup(sentence)
+            if vectors is None:
+                missing.append(sentence)
+                continue
+            tensor = torch.from_numpy(np.array(vectors)).to(flair.device)
+            for token, vector in zip(sentence, tensor):
+                start = 0
+                for name, length in sub_embeddings:
+                    token.set_embedding(name, vector[start:start + length])
+                    start += length
+        self.hits += len(sentences) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            self.embeddings.embed(missing)
+        return sentences
+
+    def to_params(self) -> Dict:
+        return {
+            "embeddings": self.embeddings.save_embeddings(use_state_dict=False),
+            "store_path": self.store_path
+        }
+
+    @classmethod
+    def from_params(cls, params: Dict) -> "PrecomputedEmbeddings":
+        # the saved path belongs to the training machine, fall back to the default store next to the code
+        store_path = params["store_path"]
+        if not os.path.isdir(store_path):
+            store_path = DEFAULT_STORE_PATH
+        return cls(load_embeddings(params["embeddings"]), store_path)
+
+
+def precompute_corpus(corpus: Corpus, embeddings: TokenEmbeddings, path: str = "embeddings", batch_size: int = 32) -> EmbeddingStore:
+    """
+    Builds the store for every sentence in the train, dev and test splits.
+    """
+    sentences: List[Sentence] = []
+    for split in (corpus.train, corpus.dev, corpus.test):
+        if split is not None:
+            sentences.extend(split)
+    return EmbeddingStore.build(sentences, embeddings, path, batch_size=batch_size)
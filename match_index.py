@@ -0,0 +1,180 @@
+import pickle
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from typing_extensions import NamedTuple
+
+
+# token fields hold one key per token, the rest hold a single key per record
+TOKEN_FIELDS = ("gold_token", "prediction_token", "dropped_prefix", "dropped_suffix", "added_prefix", "added_suffix")
+FIELDS = ("match_type", "entity_type", "credit", "sentence_id", "length_difference") + TOKEN_FIELDS
+
+
+class MatchRecord(NamedTuple):
+    """
+    One gold/prediction pair from a Scorer credit list.
+    """
+    match_type: str
+    entity_type: str
+    credit: float
+    gold: "Mention"
+    prediction: "Mention"
+    sentence_id: Optional[int]
+
+    @property
+    def length_difference(self) -> int:
+        """
+        Prediction length minus gold length, in tokens.
+        """
+        return (int(self.prediction.end) - int(self.prediction.start)) - (int(self.gold.end) - int(self.gold.start))
+
+
+def _record_keys(record: MatchRecord) -> Dict[str, List]:
+    """
+    Computes the index keys for every field of a record.
+    """
+    gold_start, gold_end = int(record.gold.start), int(record.gold.end)
+    pred_start, pred_end = int(record.prediction.start), int(record.prediction.end)
+    gold_tokens = record.gold.text.split()
+    pred_tokens = record.prediction.text.split()
+
+    return {
+        "match_type": [record.match_type],
+        "entity_type": [record.entity_type],
+        "credit": [record.credit],
+        "sentence_id": [record.sentence_id],
+        "length_difference": [record.length_difference],
+        "gold_token": gold_tokens,
+        "prediction_token": pred_tokens,
+        # tokens of one span that fall outside the other span on either side
+        "dropped_prefix": gold_tokens[:max(0, pred_start - gold_start)],
+        "dropped_suffix": gold_tokens[len(gold_tokens) - max(0, gold_end - pred_end):],
+        "added_prefix": pred_tokens[:max(0, gold_start - pred_start)],
+        "added_suffix": pred_tokens[len(pred_tokens) - max(0, pred_end - gold_end):]
+    }
+
+
+def _intersect(postings: List[np.ndarray], size: int) -> np.ndarray:
+    """
+    Intersects sorted posting arrays of ids below size, smallest first. A small result
+    is binary searched in the next array, a dense one is filtered through a bitmap of it.
+    """
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        if len(result) == 0:
+            break
+        if len(result) * 32 < size:
+            positions = np.searchsorted(other, result)
+            positions[positions == len(other)] = 0
+            result = result[other[positions] == result]
+        else:
+            bitmap = np.zeros(size, dtype=bool)
+            bitmap[other] = True
+            result = result[bitmap[result]]
+    return result
+
+
+class MatchIndex:
+    """
+    Inverted index over Scorer credit lists for error analysis.
+    Each field maps a key to the sorted ids of the records having it.
+    """
+
+    def __init__(self, records: Iterable[MatchRecord] = ()) -> None:
+        self.records: List[MatchRecord] = []
+        # new ids are collected in lists and appended to the numpy posting arrays on the next query
+        self.postings: Dict[str, Dict[object, np.ndarray]] = {field: {} for field in FIELDS}
+        self.pending: Dict[str, Dict] = {field: defaultdict(list) for field in FIELDS}
+        self.add(records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, records: Iterable[MatchRecord]) -> None:
+        """
+        Appends records to the index. Ids only grow, so posting lists stay sorted.
+        """
+        for record in records:
+            record_id = len(self.records)
+            self.records.append(record)
+            for field, keys in _record_keys(record).items():
+                for key in set(keys):
+                    self.pending[field][key].append(record_id)
+
+    def __posting_arrays(self) -> Dict[str, Dict[object, np.ndarray]]:
+        for field, keys in self.pending.items():
+            for key, ids in keys.items():
+                new_ids = np.asarray(ids, dtype=np.int64)
+                existing = self.postings[field].get(key)
+                self.postings[field][key] = new_ids if existing is None else np.concatenate([existing, new_ids])
+            keys.clear()
+        return self.postings
+
+    @staticmethod
+    def from_credit_lists(credit_lists: Dict[str, Sequence[Tuple]], sentence_ids: Dict[str, Sequence[Optional[int]]]) -> "MatchIndex":
+        """
+        Builds the index from (gold, prediction, credit) lists keyed by match type.
+        """
+        index = MatchIndex()
+        for match_type, credit_list in credit_lists.items():
+            ids = sentence_ids.get(match_type) or [None] * len(credit_list)
+            index.add(
+                MatchRecord(match_type, gold.entity_type, credit, gold, pred, sentence_id)
+                for (gold, pred, credit), sentence_id in zip(credit_list, ids)
+            )
+        return index
+
+    def match_ids(self, **conditions) -> np.ndarray:
+        """
+        Returns the sorted ids of the records matching every condition.
+        Condition names are the index fields; a list or tuple value matches any of its keys.
+        """
+        unknown = set(conditions) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown index fields: {', '.join(sorted(unknown))}")
+        if not conditions:
+            return np.arange(len(self.records), dtype=np.int64)
+
+        arrays = self.__posting_arrays()
+        postings = []
+        for field, value in conditions.items():
+            keys = value if isinstance(value, (list, tuple, set)) else [value]
+            field_postings = [arrays[field][key] for key in keys if key in arrays[field]]
+            if not field_postings:
+                return np.empty(0, dtype=np.int64)
+            if len(field_postings) == 1:
+                postings.append(field_postings[0])
+            else:
+                union = np.zeros(len(self.records), dtype=bool)
+                for ids in field_postings:
+                    union[ids] = True
+                postings.append(np.flatnonzero(union))
+        return _intersect(postings, len(self.records))
+
+    def query(self, **conditions) -> List[MatchRecord]:
+        """
+        Returns the records matching every condition, e.g.
+        query(entity_type="ORG", match_type="right", credit=0.5, dropped_prefix="@").
+        """
+        return [self.records[record_id] for record_id in self.match_ids(**conditions).tolist()]
+
+    def count(self, **conditions) -> int:
+        return len(self.match_ids(**conditions))
+
+    def save(self, path: str) -> None:
+        """
+        Writes the index to disk so it can be queried without re-scoring.
+        """
+        with open(path, mode="wb") as file:
+            pickle.dump({"records": self.records, "postings": self.__posting_arrays()}, file)
+
+    @staticmethod
+    def load(path: str) -> "MatchIndex":
+        with open(path, mode="rb") as file:
+            data = pickle.load(file)
+        index = MatchIndex()
+        index.records = data["records"]
+        index.postings.update(data["postings"])
+        return index
@@ -1,6 +1,9 @@
 from flair.data import Label
 from typing_extensions import NamedTuple
-from typing import Sequence, Dict, Tuple, List, Set, Optional
+from collections import Counter, OrderedDict
+from typing import Sequence, Dict, Iterable, Tuple, List, Set, Optional
+
+from match_index import MatchIndex
 
 
 class Mention(NamedTuple):
@@ -13,43 +16,124 @@ class Mention(NamedTuple):
     text: str
 
 
+# metric families a Scorer can compute, in report order
+FAMILIES = ("exact", "left", "right", "overlap")
+
+
 class Scorer:
-    def __init__(self, reference: Sequence[Mention], predictions: Sequence[Mention]) -> None:
+    def __init__(self, reference: Sequence[Mention], predictions: Sequence[Mention], sentence_id: Optional[int] = None,
+                 families: Optional[Iterable[str]] = None) -> None:
         """
         Compute counts necessary for easily calculating metrics.
+        The optional sentence id is kept alongside each credit list entry for error analysis.
+        Only the given metric families are computed up front (all by default); the others are
+        computed the first time one of their metrics is requested or a merge needs them.
         """
-        reference_set = set(reference)
-        predictions_set = set(predictions)
+        families = FAMILIES if families is None else tuple(families)
+        unknown = set(families) - set(FAMILIES)
+        if unknown:
+            raise ValueError(f"Unknown metric families: {', '.join(sorted(unknown))}")
 
-        # strict evaluation
-        self.true_positives = len(reference_set & predictions_set)
-        self.false_positives = len(predictions_set - reference_set)
-        self.false_negatives = len(reference_set - predictions_set)
-        
         # Store raw mentions for partial matching
         self.reference = list(reference)
         self.predictions = list(predictions)
+        self.sentence_id = sentence_id
 
         self.possible = len(self.reference) # used for recall
         self.actual = len(self.predictions) # used for precision
-        
+
+        # every family starts out empty, so merging and reporting never depend on what was computed
+        self.true_positives = 0
+        self.false_positives = 0
+        self.false_negatives = 0
+        self.left_match_tp = 0
+        self.left_match_fp = 0
+        self.left_match_fn = 0
+        self.right_match_tp = 0
+        self.right_match_fp = 0
+        self.right_match_fn = 0
+        self.partial_match_tp = 0
+        self.partial_match_fp = 0
+        self.partial_match_fn = 0
+        self.overlap_credit_list = []
+        self.left_credit_list = []
+        self.right_credit_list = []
+
+        # sentence id of each credit list entry, parallel to the lists above
+        self.credit_sentence_ids = {"overlap": [], "left": [], "right": []}
+
+        # (match type, entity type, credit) counts, kept even when the credit lists are not
+        self.credit_histogram = Counter()
+        # false once a Scorer without its histogram was merged in, e.g. a state saved without one
+        self.has_histogram = True
+
+        # families whose counts are valid, and whether the raw mentions still cover all counts
+        self.families: Set[str] = set()
+        self.can_compute = True
+        for family in families:
+            self.compute(family)
+
+    def compute(self, family: str) -> None:
+        """
+        Computes the counts of one metric family from the stored mentions, if not done already.
+        """
+        if family in self.families:
+            return
+        if family not in FAMILIES:
+            raise ValueError(f"Unknown metric family: {family}")
+        if not self.can_compute:
+            raise ValueError(f"'{family}' metrics were not computed before this Scorer was merged or loaded")
+
+        if family == "exact":
+            self.__count_exact_matches()
+        elif family == "left":
+            self.__count_left_matches()
+        elif family == "right":
+            self.__count_right_matches()
+        else:
+            self.partial_match_tp, self.partial_match_fp, self.partial_match_fn, self.overlap_credit_list = self.__count_partial_matches()
+            self.__record_credits("overlap", self.overlap_credit_list)
+        self.families.add(family)
+
+    def __reset(self, family: str) -> None:
+        """
+        Clears the counts and credit data of one metric family.
+        """
+        if family == "exact":
+            self.true_positives = self.false_positives = self.false_negatives = 0
+            return
+        prefix = "partial" if family == "overlap" else family
+        setattr(self, f"{prefix}_match_tp", 0)
+        setattr(self, f"{prefix}_match_fp", 0)
+        setattr(self, f"{prefix}_match_fn", 0)
+        setattr(self, f"{family}_credit_list", [])
+        self.credit_sentence_ids[family] = []
+        for key in [key for key in self.credit_histogram if key[0] == family]:
+            del self.credit_histogram[key]
+
+    def __record_credits(self, match_type: str, credit_list: List[Tuple[Mention, Mention, float]]) -> None:
+        self.credit_sentence_ids[match_type] = [self.sentence_id] * len(credit_list)
+        for ref, _, credit in credit_list:
+            self.credit_histogram[(match_type, ref.entity_type, credit)] += 1
+
+    def __count_exact_matches(self) -> None:
+        reference_set = set(self.reference)
+        predictions_set = set(self.predictions)
+
+        # strict evaluation
+        self.true_positives = len(reference_set & predictions_set)
+        self.false_positives = len(predictions_set - reference_set)
+        self.false_negatives = len(reference_set - predictions_set)
+
+    def __count_left_matches(self) -> None:
         # Calculate Left Boundary Matches (Boundary + Type)
-        left_reference_set = set([(mention.start, mention.entity_type) for mention in reference])
-        left_predictions_set = set([(mention.start, mention.entity_type) for mention in predictions])
+        left_reference_set = set([(mention.start, mention.entity_type) for mention in self.reference])
+        left_predictions_set = set([(mention.start, mention.entity_type) for mention in self.predictions])
         self.left_match_tp = len(left_reference_set & left_predictions_set)
         self.left_match_fp = len(left_predictions_set - left_reference_set)
         self.left_match_fn = len(left_reference_set - left_predictions_set)
 
-        # Calculate Right Boundary Matches (Boundary + Type)
-        right_reference_set = set([(mention.end, mention.entity_type) for mention in reference])
-        right_predictions_set = set([(mention.end, mention.entity_type) for mention in predictions])
-        self.right_match_tp = len(right_reference_set & right_predictions_set)
-        self.right_match_fp = len(right_predictions_set - right_reference_set)
-        self.right_match_fn = len(right_reference_set - right_predictions_set)
-
-        self.partial_match_tp, self.partial_match_fp, self.partial_match_fn, self.overlap_credit_list = self.__count_partial_matches()
-
-        # build left/right credit lists for CSV output (credit based on exact vs partial boundary match)
+        # build left credit list for CSV output (credit based on exact vs partial boundary match)
         self.left_credit_list = []
         for ref in self.reference:
             for pred in self.predictions:
@@ -62,7 +146,17 @@ class Scorer:
                         credit = 0.5
                         self.left_match_tp -= 0.5 # partial matches worth half credit towards score
                     self.left_credit_list.append((ref, pred, credit))
+        self.__record_credits("left", self.left_credit_list)
+
+    def __count_right_matches(self) -> None:
+        # Calculate Right Boundary Matches (Boundary + Type)
+        right_reference_set = set([(mention.end, mention.entity_type) for mention in self.reference])
+        right_predictions_set = set([(mention.end, mention.entity_type) for mention in self.predictions])
+        self.right_match_tp = len(right_reference_set & right_predictions_set)
+        self.right_match_fp = len(right_predictions_set - right_reference_set)
+        self.right_match_fn = len(right_reference_set - right_predictions_set)
 
+        # build right credit list for CSV output (credit based on exact vs partial boundary match)
         self.right_credit_list = []
         for ref in self.reference:
             for pred in self.predictions:
@@ -75,6 +169,7 @@ class Scorer:
                         credit = 0.5
                         self.right_match_tp -= 0.5 # partial matches worth half credit towards score
                     self.right_credit_list.append((ref, pred, credit))
+        self.__record_credits("right", self.right_credit_list)
 
     def __count_partial_matches(self) -> tuple[int, int, int]:
         partial_match_tp = 0
@@ -159,6 +254,7 @@ class Scorer:
         """
         Finds exact mention-level precision using pre-computed counts.
         """
+        self.compute("exact")
         if self.true_positives + self.false_positives == 0:
             return 0.0
         return self.true_positives / (self.true_positives + self.false_positives)
@@ -167,6 +263,7 @@ class Scorer:
         """
         Finds exact mention-level recall using pre-computed counts.
         """
+        self.compute("exact")
         if self.true_positives + self.false_negatives == 0:
             return 0.0
         return self.true_positives / (self.true_positives + self.false_negatives)
@@ -183,6 +280,7 @@ class Scorer:
         """
         Precision for left boundary matches.
         """
+        self.compute("left")
         if self.left_match_tp + self.left_match_fp == 0:
             return 0.0
         return self.left_match_tp / self.actual
@@ -191,6 +289,7 @@ class Scorer:
         """
         Recall for left boundary matches.
         """
+        self.compute("left")
         if self.left_match_tp + self.left_match_fn == 0:
             return 0.0
         return self.left_match_tp / self.possible
@@ -209,6 +308,7 @@ class Scorer:
         """
         Precision for left boundary matches.
         """
+        self.compute("right")
         if self.right_match_tp + self.right_match_fp == 0:
             return 0.0
         return self.right_match_tp / self.actual
@@ -217,6 +317,7 @@ class Scorer:
         """
         Recall for left boundary matches.
         """
+        self.compute("right")
         if self.right_match_tp + self.right_match_fn == 0:
             return 0.0
         return self.right_match_tp / self.possible
@@ -235,6 +336,7 @@ class Scorer:
         """
         Precision for left boundary matches.
         """
+        self.compute("overlap")
         if self.actual == 0:
             return 0.0
         return self.partial_match_tp / self.actual
@@ -243,6 +345,7 @@ class Scorer:
         """
         Recall for left boundary matches.
         """
+        self.compute("overlap")
         if self.possible == 0:
             return 0.0
         return self.partial_match_tp / self.possible
@@ -258,64 +361,103 @@ class Scorer:
         return (2 * precision * recall) / (precision + recall)
     
     def partial_credit_ratio(self) -> float:
-        total = len(self.overlap_credit_list)
+        self.compute("overlap")
+        if not self.has_histogram:
+            raise ValueError("The credit histogram is incomplete, a merged Scorer state was saved without it")
+        total = 0
         partial_count = 0
-        for mention in self.overlap_credit_list:
-            if mention[2] != 1:
-                partial_count += 1
+        for (match_type, _, credit), count in self.credit_histogram.items():
+            if match_type == "overlap":
+                total += count
+                if credit != 1:
+                    partial_count += count
         if total == 0:
             return 0.0
         return partial_count/total
 
-    def merge(self, other_scorer: "Scorer") -> None:
+    def merge(self, other_scorer: "Scorer", sentence_id: Optional[int] = None) -> None:
         """
         Adds the other Scorer's counts to this one.
-        """
-        self.true_positives += other_scorer.true_positives
-        self.false_positives += other_scorer.false_positives
-        self.false_negatives += other_scorer.false_negatives
-
-        self.left_match_tp += other_scorer.left_match_tp
-        self.left_match_fp += other_scorer.left_match_fp
-        self.left_match_fn += other_scorer.left_match_fn
-
-        self.right_match_tp += other_scorer.right_match_tp
-        self.right_match_fp += other_scorer.right_match_fp
-        self.right_match_fn += other_scorer.right_match_fn 
-
-        self.partial_match_tp += other_scorer.partial_match_tp
-        self.partial_match_fp += other_scorer.partial_match_fp
-        self.partial_match_fn += other_scorer.partial_match_fn
-
-        self.overlap_credit_list.extend(other_scorer.overlap_credit_list)
-        self.left_credit_list.extend(other_scorer.left_credit_list)
-        self.right_credit_list.extend(other_scorer.right_credit_list)
+        If a sentence id is given, the other Scorer's credit list entries are attributed to it.
+        Families this Scorer has are computed on the other one if it still can, and dropped otherwise.
+        """
+        for family in FAMILIES:
+            if family in self.families and other_scorer.can_compute:
+                other_scorer.compute(family)
+        # families the other Scorer lacks are dropped, along with the partial data kept for them
+        for family in self.families - other_scorer.families:
+            self.__reset(family)
+        self.families &= other_scorer.families
+        self.can_compute = False
+
+        if "exact" in self.families:
+            self.true_positives += other_scorer.true_positives
+            self.false_positives += other_scorer.false_positives
+            self.false_negatives += other_scorer.false_negatives
+
+        if "left" in self.families:
+            self.left_match_tp += other_scorer.left_match_tp
+            self.left_match_fp += other_scorer.left_match_fp
+            self.left_match_fn += other_scorer.left_match_fn
+
+        if "right" in self.families:
+            self.right_match_tp += other_scorer.right_match_tp
+            self.right_match_fp += other_scorer.right_match_fp
+            self.right_match_fn += other_scorer.right_match_fn 
+
+        if "overlap" in self.families:
+            self.partial_match_tp += other_scorer.partial_match_tp
+            self.partial_match_fp += other_scorer.partial_match_fp
+            self.partial_match_fn += other_scorer.partial_match_fn
+
+        # only credit data of tracked families is copied, so a narrow Scorer stays cheap
+        for match_type, credit_list in other_scorer.credit_lists().items():
+            if match_type not in self.families:
+                continue
+            getattr(self, f"{match_type}_credit_list").extend(credit_list)
+            sentence_ids = other_scorer.credit_sentence_ids[match_type]
+            if sentence_id is not None:
+                sentence_ids = [sentence_id] * len(sentence_ids)
+            self.credit_sentence_ids[match_type].extend(sentence_ids)
+        # a histogram missing from one side would make the merged ratios cover only part of the data
+        self.has_histogram = self.has_histogram and other_scorer.has_histogram
+        if not self.has_histogram:
+            self.credit_histogram.clear()
+        for key, count in other_scorer.credit_histogram.items():
+            if key[0] in self.families and self.has_histogram:
+                self.credit_histogram[key] += count
 
         self.possible += other_scorer.possible
         self.actual += other_scorer.actual
 
     def print_score_report(self):
-        print(f"Exact F1: {self.f1_score() * 100:0.2f}")
-        print(f"Left boundary match F1: {self.left_match_f1() * 100:0.2f}")
-        print(f"Right boundary match F1: {self.right_match_f1() * 100:0.2f}")
-        print(f"Partial boundary match F1: {self.partial_match_f1() * 100:0.2f}")
-        print(f"\tPercent given partial credit: {self.partial_credit_ratio() * 100:0.2f}")
+        if "exact" in self.families:
+            print(f"Exact F1: {self.f1_score() * 100:0.2f}")
+        if "left" in self.families:
+            print(f"Left boundary match F1: {self.left_match_f1() * 100:0.2f}")
+        if "right" in self.families:
+            print(f"Right boundary match F1: {self.right_match_f1() * 100:0.2f}")
+        if "overlap" in self.families:
+            print(f"Partial boundary match F1: {self.partial_match_f1() * 100:0.2f}")
+            if self.has_histogram:
+                print(f"\tPercent given partial credit: {self.partial_credit_ratio() * 100:0.2f}")
+            else:
+                print("\tPercent given partial credit: n/a, the credit histogram is incomplete")
 
     def write_partial_matches(self, path: str, match_type: str = "overlap") -> None:
         """
         Writes matches to CSV with credit column for overlap/left/right.
         """
+        if match_type not in ("overlap", "left", "right"):
+            print(f"Warning: Unknown match_type '{match_type}' for writing partial matches.")
+            return # Or raise error
+
+        # compute the family before reading its list, computing replaces the list
+        self.compute(match_type)
+        credit_list = self.credit_lists()[match_type]
+
         with open(path, mode='w', encoding='utf8') as file:
             file.write("gold, prediction, credit\n") 
-            if match_type == "overlap":
-                credit_list = self.overlap_credit_list
-            elif match_type == "left":
-                credit_list = self.left_credit_list
-            elif match_type == "right":
-                credit_list = self.right_credit_list
-            else:
-                print(f"Warning: Unknown match_type '{match_type}' for writing partial matches.")
-                return # Or raise error
 
             # Write data from the selected list
             for gold, pred, cred in credit_list:
@@ -324,27 +466,43 @@ class Scorer:
                 pred_text = f'"{pred.text}"' if ',' in pred.text else pred.text
                 file.write(f"{gold_text},{pred_text},{cred}\n")
 
-    def get_score_dict(self):
+    def credit_lists(self) -> Dict[str, List[Tuple[Mention, Mention, float]]]:
+        """
+        The overlap/left/right credit lists keyed by match type.
+        """
         return {
-            'Metric': ['Exact Match', 'Left Boundary', 'Right Boundary', 'Partial (Overlap)'],
-            'Precision': [
-                self.precision(),
-                self.left_match_precision(),
-                self.right_match_precision(),
-                self.partial_match_precision()
-            ],
-            'Recall': [
-                self.recall(),
-                self.left_match_recall(),
-                self.right_match_recall(),
-                self.partial_match_recall()
-            ],
-            'F1 Score': [
-                self.f1_score(),
-                self.left_match_f1(),
-                self.right_match_f1(),
-                self.partial_match_f1()
-            ]
+            "overlap": self.overlap_credit_list,
+            "left": self.left_credit_list,
+            "right": self.right_credit_list
+        }
+
+    def build_index(self, path: Optional[str] = None) -> MatchIndex:
+        """
+        Builds an inverted index over the overlap/left/right credit lists.
+        If a path is given, the index is also written to disk.
+        """
+        index = MatchIndex.from_credit_lists(self.credit_lists(), self.credit_sentence_ids)
+        if path is not None:
+            index.save(path)
+        return index
+
+    def get_score_dict(self, families: Optional[Iterable[str]] = None):
+        """
+        Precision, recall and F1 of the given metric families, by default the ones computed so far.
+        """
+        families = self.families if families is None else set(families)
+        rows = {
+            "exact": ('Exact Match', self.precision, self.recall, self.f1_score),
+            "left": ('Left Boundary', self.left_match_precision, self.left_match_recall, self.left_match_f1),
+            "right": ('Right Boundary', self.right_match_precision, self.right_match_recall, self.right_match_f1),
+            "overlap": ('Partial (Overlap)', self.partial_match_precision, self.partial_match_recall, self.partial_match_f1)
+        }
+        selected = [rows[family] for family in FAMILIES if family in families]
+        return {
+            'Metric': [name for name, _, _, _ in selected],
+            'Precision': [precision() for _, precision, _, _ in selected],
+            'Recall': [recall() for _, _, recall, _ in selected],
+            'F1 Score': [f1() for _, _, _, f1 in selected]
         }
 
     @staticmethod
@@ -360,4 +518,42 @@ class Scorer:
             end = label.unlabeled_identifier.split(":")[1].split("]")[0]
             text = label.data_point.text
             mentions.append(Mention(entity_type, start, end, text))
-        return mentions
\ No newline at end of file
+        return mentions
+
+
+class ScorerCache:
+    """
+    Bounded LRU of per-sentence Scorers keyed by the (reference, predictions) mention tuples,
+    so repeated sentences such as retweets are only matched once.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self.cache: "OrderedDict[Tuple[Tuple[Mention, ...], Tuple[Mention, ...]], Scorer]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def score(self, reference: Sequence[Mention], predictions: Sequence[Mention]) -> Scorer:
+        """
+        Returns the Scorer for the mentions, computing it on a miss.
+        The returned Scorer is shared, so merge it into another one rather than modifying it.
+        """
+        key = (tuple(reference), tuple(predictions))
+        scorer = self.cache.get(key)
+        if scorer is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return scorer
+
+        self.misses += 1
+        # families are computed when the Scorer is first merged, and stay cached with it
+        scorer = Scorer(reference, predictions, families=())
+        self.cache[key] = scorer
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return scorer
+
+    def hit_rate(self) -> float:
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
@@ -0,0 +1,284 @@
+import argparse
+import os
+import struct
+import zlib
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from scorer import FAMILIES, Mention, Scorer, ScorerCache
+
+
+MAGIC = b"NERS"
+FORMAT_VERSION = 2
+
+HAS_HISTOGRAM = 1
+HAS_RECORDS = 2
+
+MATCH_TYPES = ("overlap", "left", "right")
+COUNTER_FIELDS = (
+    "true_positives", "false_positives", "false_negatives",
+    "left_match_tp", "left_match_fp", "left_match_fn",
+    "right_match_tp", "right_match_fp", "right_match_fn",
+    "partial_match_tp", "partial_match_fp", "partial_match_fn",
+    "possible", "actual"
+)
+
+# one int64 row per credit record: gold type/start/end/text, prediction type/start/end/text, sentence id
+RECORD_WIDTH = 9
+# version 2 added a bitmask of the computed metric families, version 1 files have all of them
+HEADER_V1 = struct.Struct("<4sBB")
+HEADER = struct.Struct("<4sBBB")
+SENTENCE_ID_PREFIX = "# sentence_id = "
+
+
+def dump_state(scorer: Scorer, include_histogram: bool = True, include_records: bool = True) -> bytes:
+    """
+    Serializes the mergeable state of a Scorer: its counters and computed metric families,
+    and optionally the credit histogram and the credit records with their sentence ids.
+    """
+    include_histogram = include_histogram and scorer.has_histogram
+    flags = (HAS_HISTOGRAM if include_histogram else 0) | (HAS_RECORDS if include_records else 0)
+    families = sum(1 << i for i, family in enumerate(FAMILIES) if family in scorer.families)
+
+    strings: Dict[str, int] = {}
+
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    sections = [struct.pack(f"<{len(COUNTER_FIELDS)}d", *(getattr(scorer, field) for field in COUNTER_FIELDS))]
+
+    if include_histogram:
+        histogram = [(MATCH_TYPES.index(match_type), string_id(entity_type), credit, count)
+                     for (match_type, entity_type, credit), count in scorer.credit_histogram.items()]
+        sections.append(struct.pack("<I", len(histogram)))
+        sections.extend(struct.pack("<BIdQ", *row) for row in histogram)
+
+    if include_records:
+        credit_lists = scorer.credit_lists()
+        for match_type in MATCH_TYPES:
+            rows = array("q")
+            credits = array("d")
+            for (gold, pred, credit), sentence_id in zip(credit_lists[match_type], scorer.credit_sentence_ids[match_type]):
+                rows.extend((string_id(gold.entity_type), int(gold.start), int(gold.end), string_id(gold.text),
+                             string_id(pred.entity_type), int(pred.start), int(pred.end), string_id(pred.text),
+                             -1 if sentence_id is None else sentence_id))
+                credits.append(credit)
+            sections.append(struct.pack("<I", len(credits)))
+            sections.append(rows.tobytes())
+            sections.append(credits.tobytes())
+
+    # string table goes first in the body so the reader can resolve ids in one pass
+    encoded = [value.encode("utf8") for value in strings]
+    table = [struct.pack("<I", len(encoded))] + [struct.pack("<I", len(value)) + value for value in encoded]
+
+    body = b"".join(sections[:1] + table + sections[1:])
+    return HEADER.pack(MAGIC, FORMAT_VERSION, flags, families) + zlib.compress(body)
+
+
+def load_state(data: bytes) -> Scorer:
+    """
+    Rebuilds a Scorer from dump_state output. Sections that were left out stay empty,
+    and a Scorer loaded without its histogram has has_histogram unset.
+    """
+    magic, version, flags = HEADER_V1.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a Scorer state file")
+    if version == 1:
+        families, header_size = (1 << len(FAMILIES)) - 1, HEADER_V1.size
+    elif version == FORMAT_VERSION:
+        families, header_size = HEADER.unpack_from(data)[3], HEADER.size
+    else:
+        raise ValueError(f"Unsupported Scorer state version {version}, expected at most {FORMAT_VERSION}")
+
+    body = zlib.decompress(data[header_size:])
+    offset = 0
+
+    def read(fmt: str) -> Tuple:
+        nonlocal offset
+        values = struct.unpack_from(fmt, body, offset)
+        offset += struct.calcsize(fmt)
+        return values
+
+    scorer = Scorer([], [], families=())
+    scorer.families = {family for i, family in enumerate(FAMILIES) if families & (1 << i)}
+    scorer.can_compute = False
+    for field, value in zip(COUNTER_FIELDS, read(f"<{len(COUNTER_FIELDS)}d")):
+        # counts other than the half-credit true positives are whole numbers
+        setattr(scorer, field, value if field.endswith("_tp") else int(value))
+
+    strings = []
+    for _ in range(read("<I")[0]):
+        length = read("<I")[0]
+        strings.append(body[offset:offset + length].decode("utf8"))
+        offset += length
+
+    scorer.has_histogram = bool(flags & HAS_HISTOGRAM)
+    if scorer.has_histogram:
+        for _ in range(read("<I")[0]):
+            match_type, entity_type, credit, count = read("<BIdQ")
+            scorer.credit_histogram[(MATCH_TYPES[match_type], strings[entity_type], credit)] = count
+
+    if flags & HAS_RECORDS:
+        credit_lists = scorer.credit_lists()
+        for match_type in MATCH_TYPES:
+            count = read("<I")[0]
+            rows = array("q")
+            rows.frombytes(body[offset:offset + count * RECORD_WIDTH * rows.itemsize])
+            offset += count * RECORD_WIDTH * rows.itemsize
+            credits = array("d")
+            credits.frombytes(body[offset:offset + count * credits.itemsize])
+            offset += count * credits.itemsize
+            for i, credit in enumerate(credits):
+                row = rows[i * RECORD_WIDTH:(i + 1) * RECORD_WIDTH]
+                gold = Mention(strings[row[0]], row[1], row[2], strings[row[3]])
+                pred = Mention(strings[row[4]], row[5], row[6], strings[row[7]])
+                credit_lists[match_type].append((gold, pred, credit))
+                scorer.credit_sentence_ids[match_type].append(None if row[8] == -1 else row[8])
+
+    return scorer
+
+
+def save_state(scorer: Scorer, path: str, include_histogram: bool = True, include_records: bool = True) -> None:
+    with open(path, mode="wb") as file:
+        file.write(dump_state(scorer, include_histogram=include_histogram, include_records=include_records))
+
+
+def read_state(path: str) -> Scorer:
+    with open(path, mode="rb") as file:
+        return load_state(file.read())
+
+
+def mentions_from_tags(tokens: Sequence[str], tags: Sequence[str]) -> List[Mention]:
+    """
+    Decodes BIO tags into mentions. An I tag that does not continue a mention of the same type starts a new one.
+    """
+    mentions = []
+    start, entity_type = None, None
+    for i, tag in enumerate(list(tags) + ["O"]):
+        prefix, _, tag_type = tag.partition("-")
+        if entity_type is not None and (prefix != "I" or tag_type != entity_type):
+            mentions.append(Mention(entity_type, start, i, " ".join(tokens[start:i])))
+            start, entity_type = None, None
+        if prefix in ("B", "I") and entity_type is None:
+            start, entity_type = i, tag_type
+    return mentions
+
+
+def tags_from_mentions(length: int, mentions: Iterable[Mention]) -> List[str]:
+    """
+    Encodes mentions as BIO tags for a sentence of the given length.
+    """
+    tags = ["O"] * length
+    for mention in mentions:
+        start, end = int(mention.start), int(mention.end)
+        tags[start] = f"B-{mention.entity_type}"
+        for i in range(start + 1, end):
+            tags[i] = f"I-{mention.entity_type}"
+    return tags
+
+
+def read_dump(path: str) -> Iterator[Tuple[Optional[int], List[str], List[str], List[str]]]:
+    """
+    Reads a prediction dump: token, gold tag and predicted tag per line, sentences separated
+    by blank lines and optionally preceded by a sentence id comment.
+    Yields (sentence id, tokens, gold tags, predicted tags).
+    """
+    sentence_id, tokens, gold, pred = None, [], [], []
+    with open(path, encoding="utf8") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if line.startswith(SENTENCE_ID_PREFIX):
+                sentence_id = int(line[len(SENTENCE_ID_PREFIX):])
+            elif line.strip() == "":
+                if tokens:
+                    yield sentence_id, tokens, gold, pred
+                sentence_id, tokens, gold, pred = None, [], [], []
+            else:
+                token, gold_tag, pred_tag = line.split("\t")
+                tokens.append(token)
+                gold.append(gold_tag)
+                pred.append(pred_tag)
+    if tokens:
+        yield sentence_id, tokens, gold, pred
+
+
+def write_dump(path: str, sentences: Iterable[Tuple[Optional[int], Sequence[str], Sequence[str], Sequence[str]]]) -> None:
+    """
+    Writes (sentence id, tokens, gold tags, predicted tags) tuples in the format read by read_dump.
+    """
+    with open(path, mode="w", encoding="utf8") as file:
+        for sentence_id, tokens, gold, pred in sentences:
+            if sentence_id is not None:
+                file.write(f"{SENTENCE_ID_PREFIX}{sentence_id}\n")
+            for row in zip(tokens, gold, pred):
+                file.write("\t".join(row))
+                file.write("\n")
+            file.write("\n")
+
+
+def shard_dump(path: str, shards: int, output_dir: str) -> List[str]:
+    """
+    Splits a prediction dump into contiguous shards, numbering sentences so ids stay global.
+    """
+    sentences = [(i if sentence_id is None else sentence_id, tokens, gold, pred)
+                 for i, (sentence_id, tokens, gold, pred) in enumerate(read_dump(path))]
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    size = -(-len(sentences) // shards) if sentences else 0
+    paths = []
+    for shard in range(shards):
+        shard_path = os.path.join(output_dir, f"{name}.shard-{shard}.tsv")
+        write_dump(shard_path, sentences[shard * size:(shard + 1) * size])
+        paths.append(shard_path)
+    return paths
+
+
+def score_dump(path: str, cache_size: int = 4096, families: Optional[Iterable[str]] = None) -> Scorer:
+    scores = Scorer([], [], families=families)
+    cache = ScorerCache(maxsize=cache_size)
+    for i, (sentence_id, tokens, gold, pred) in enumerate(read_dump(path)):
+        scores.merge(cache.score(mentions_from_tags(tokens, gold), mentions_from_tags(tokens, pred)),
+                     sentence_id=i if sentence_id is None else sentence_id)
+    print(f"Scorer cache: {cache.hits} hits, {cache.misses} misses, hit rate {cache.hit_rate() * 100:0.2f}%")
+    return scores
+
+
+def merge_states(paths: Iterable[str]) -> Scorer:
+    scores = Scorer([], [])
+    for path in paths:
+        scores.merge(read_state(path))
+    return scores
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded scoring of prediction dumps with mergeable Scorer state files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    shard_parser = commands.add_parser("shard", help="split a prediction dump into shards")
+    shard_parser.add_argument("dump")
+    shard_parser.add_argument("--shards", type=int, required=True)
+    shard_parser.add_argument("--output-dir", default="shards")
+
+    score_parser = commands.add_parser("score", help="score a dump or shard into a state file")
+    score_parser.add_argument("dump")
+    score_parser.add_argument("--output", required=True)
+    score_parser.add_argument("--no-histogram", action="store_true")
+    score_parser.add_argument("--no-records", action="store_true")
+    score_parser.add_argument("--families", nargs="+", choices=FAMILIES, default=None, help="metric families to compute, all by default")
+
+    merge_parser = commands.add_parser("merge", help="combine state files into one")
+    merge_parser.add_argument("states", nargs="+")
+    merge_parser.add_argument("--output", required=True)
+    merge_parser.add_argument("--no-histogram", action="store_true")
+    merge_parser.add_argument("--no-records", action="store_true")
+    merge_parser.add_argument("--report", action="store_true", help="print the merged score report")
+
+    args = parser.parse_args()
+    if args.command == "shard":
+        for shard_path in shard_dump(args.dump, args.shards, args.output_dir):
+            print(shard_path)
+    else:
+        scores = score_dump(args.dump, families=args.families) if args.command == "score" else merge_states(args.states)
+        save_state(scores, args.output, include_histogram=not args.no_histogram, include_records=not args.no_records)
+        if getattr(args, "report", False):
+            scores.print_score_report()
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from typing import Dict, List
+
+from flair.data import Sentence
+
+from analysis import check_quantized_scores, predict
+from embedding_store import EmbeddingStore, PrecomputedEmbeddings
+from test_embedding_store import example_sentences, example_stack
+
+
+class StubTagger:
+    """
+    Stands in for a SequenceTagger: embeds each batch and tags its first two tokens as a PER span,
+    plus a token label on the last token when token predictions are forced.
+    """
+
+    def __init__(self, embeddings) -> None:
+        self.embeddings = embeddings
+        self.predicted: List[Sentence] = []
+
+    def predict(self, batch: List[Sentence], force_token_predictions: bool = False) -> None:
+        self.embeddings.embed(batch)
+        for sentence in batch:
+            self.predicted.append(sentence)
+            sentence[0:2].add_label('ner', 'PER', 1.0 / len(sentence))
+            if force_token_predictions:
+                sentence[-1].add_label('ner', 'O', 0.5)
+
+
+class TestPredict(unittest.TestCase):
+    def test_repoints_saved_store(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            EmbeddingStore.build(example_sentences(), example_stack(), directory)
+            # as loaded from a model trained on a machine whose store is not here
+            model = StubTagger(PrecomputedEmbeddings(example_stack(), os.path.join(directory, "training-machine")))
+            with contextlib.redirect_stdout(io.StringIO()):
+                predict(example_sentences(), model, batch_size=2, embedding_store=directory)
+            self.assertEqual(directory, model.embeddings.store_path)
+            self.assertEqual(2, model.embeddings.hits)
+            self.assertEqual(0, model.embeddings.misses)
+
+    def test_duplicates_get_identical_labels(self) -> None:
+        for force_token_labels in (False, True):
+            sentences = example_sentences() + [Sentence("Allen Iverson")]
+            # gold labels of a duplicate are replaced like those of the predicted sentences
+            sentences[2][0:1].add_label('ner', 'ORG')
+            model = StubTagger(example_stack())
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                predictions = predict(sentences, model, batch_size=2, force_token_labels=force_token_labels)
+
+            self.assertEqual(sentences, predictions)
+            self.assertEqual([sentences[0], sentences[1]], model.predicted)
+            self.assertIn("Prediction cache: 2 unique of 4 sentences, hit rate 50.00%", output.getvalue())
+            for original, duplicate in ((sentences[0], sentences[2]), (sentences[1], sentences[3])):
+                labels = [(label.data_point.unlabeled_identifier, label.value, label.score) for label in original.get_labels('ner')]
+                self.assertEqual(labels, [(label.data_point.unlabeled_identifier, label.value, label.score)
+                                          for label in duplicate.get_labels('ner')])
+                self.assertEqual(2 if force_token_labels else 1, len(labels))
+                # the copies are attached to the duplicate's own tokens
+                self.assertTrue(all(label.data_point.sentence is duplicate for label in duplicate.get_labels('ner')))
+
+
+def scores(exact_f1: float, partial_f1: float) -> Dict:
+    return {'Exact F1': exact_f1, 'Partial F1': partial_f1}
+
+
+class TestQuantizedScores(unittest.TestCase):
+    def test_within_tolerance(self) -> None:
+        check_quantized_scores(scores(0.80, 0.85), scores(0.795, 0.86), tolerance=0.01)
+
+    def test_at_tolerance(self) -> None:
+        # 0.80 - 0.79 is slightly above 0.01 in floating point
+        check_quantized_scores(scores(0.80, 0.85), scores(0.79, 0.84), tolerance=0.01)
+
+    def test_exact_f1_drop(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "Exact F1"):
+            check_quantized_scores(scores(0.80, 0.85), scores(0.78, 0.85), tolerance=0.01)
+
+    def test_partial_f1_drop(self) -> None:
+        with self.assertRaisesRegex(RuntimeError, "Partial F1 dropped from 0.8500 to 0.8300 on test"):
+            check_quantized_scores(scores(0.80, 0.85), scores(0.80, 0.83), tolerance=0.01, split="test")
@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+from typing import Dict, List
+from unittest import mock
+
+import torch
+
+from flair.data import Sentence
+from flair.embeddings import StackedEmbeddings, TokenEmbeddings
+from flair.embeddings.base import register_embeddings
+
+import embedding_store
+from embedding_store import EmbeddingStore, PrecomputedEmbeddings
+
+
+@register_embeddings
+class FixedEmbeddings(TokenEmbeddings):
+    """
+    Deterministic embeddings that differ per name and token position.
+    """
+
+    def __init__(self, name: str, length: int, offset: float) -> None:
+        super().__init__()
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.static_embeddings = True
+
+    @property
+    def embedding_length(self) -> int:
+        return self.length
+
+    def _add_embeddings_internal(self, sentences: List[Sentence]) -> List[Sentence]:
+        for sentence in sentences:
+            for token in sentence:
+                token.set_embedding(self.name, torch.arange(self.length, dtype=torch.float) + self.offset + 100 * token.idx)
+        return sentences
+
+    def to_params(self) -> Dict:
+        return {"name": self.name, "length": self.length, "offset": self.offset}
+
+    @classmethod
+    def from_params(cls, params: Dict) -> "FixedEmbeddings":
+        return cls(params["name"], params["length"], params["offset"])
+
+
+def example_stack() -> StackedEmbeddings:
+    # stack order differs from name order, like twitter/news-forward/news-backward
+    return StackedEmbeddings(embeddings=[
+        FixedEmbeddings("twitter", 3, 0.0),
+        FixedEmbeddings("news-forward", 2, 10.0),
+        FixedEmbeddings("news-backward", 4, 20.0)
+    ])
+
+
+def example_sentences() -> List[Sentence]:
+    return [Sentence("@ firefox is great"), Sentence("Allen Iverson"), Sentence("@ firefox is great")]
+
+
+class TestPrecomputedEmbeddings(unittest.TestCase):
+    def test_matches_live_embeddings(self) -> None:
+        stack = example_stack()
+        live = example_sentences()
+        stack.embed(live)
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore.build(example_sentences(), stack, directory)
+            self.assertEqual(2, len(store))
+
+            precomputed = PrecomputedEmbeddings(example_stack(), directory)
+            sentences = example_sentences()
+            precomputed.embed(sentences)
+
+            for live_sentence, sentence in zip(live, sentences):
+                for live_token, token in zip(live_sentence, sentence):
+                    self.assertTrue(torch.equal(
+                        live_token.get_embedding(stack.get_names()).cpu(),
+                        token.get_embedding(precomputed.get_names()).cpu()
+                    ))
+            self.assertEqual(3, precomputed.hits)
+            self.assertEqual(0, precomputed.misses)
+
+    def test_embeds_once(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            EmbeddingStore.build(example_sentences(), example_stack(), directory)
+            precomputed = PrecomputedEmbeddings(example_stack(), directory)
+            sentences = example_sentences()
+            precomputed.embed(sentences)
+            precomputed.embed(sentences)
+            self.assertEqual(3, precomputed.hits)
+
+    def test_missing_sentence_falls_back(self) -> None:
+        stack = example_stack()
+        live = [Sentence("not in the store")]
+        stack.embed(live)
+
+        with tempfile.TemporaryDirectory() as directory:
+            EmbeddingStore.build(example_sentences(), example_stack(), directory)
+            precomputed = PrecomputedEmbeddings(example_stack(), directory)
+            sentences = [Sentence("not in the store")]
+            precomputed.embed(sentences)
+            self.assertEqual(1, precomputed.misses)
+            for live_token, token in zip(live[0], sentences[0]):
+                self.assertTrue(torch.equal(
+                    live_token.get_embedding(stack.get_names()).cpu(),
+                    token.get_embedding(precomputed.get_names()).cpu()
+                ))
+
+    def test_set_store(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            EmbeddingStore.build(example_sentences(), example_stack(), directory)
+            precomputed = PrecomputedEmbeddings(example_stack(), os.path.join(directory, "elsewhere"))
+            precomputed.set_store(directory)
+            precomputed.embed(example_sentences())
+            self.assertEqual(3, precomputed.hits)
+
+    def test_loaded_without_saved_store_uses_default(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            EmbeddingStore.build(example_sentences(), example_stack(), directory)
+            params = PrecomputedEmbeddings(example_stack(), os.path.join(directory, "training-machine")).save_embeddings(use_state_dict=False)
+            with mock.patch.object(embedding_store, "DEFAULT_STORE_PATH", directory):
+                loaded = embedding_store.load_embeddings(params)
+            self.assertEqual(directory, loaded.store_path)
+            loaded.embed(example_sentences())
+            self.assertEqual(3, loaded.hits)
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+import unittest
+from typing import Iterator
+
+from match_index import MatchIndex, MatchRecord
+from scorer import Mention, Scorer
+
+
+class TestMatchIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scores = Scorer([], [])
+        reference = [Mention("ORG", 0, 2, "@ firefox"), Mention("PER", 3, 5, "Allen Iverson")]
+        predictions = [Mention("ORG", 1, 2, "firefox"), Mention("PER", 3, 5, "Allen Iverson")]
+        self.scores.merge(Scorer(reference, predictions, sentence_id=0))
+        reference_two = [Mention("ORG", 0, 2, "Philips AVENT")]
+        predictions_two = [Mention("ORG", 0, 1, "Philips")]
+        self.scores.merge(Scorer(reference_two, predictions_two, sentence_id=1))
+        self.index = self.scores.build_index()
+
+    def test_record_count(self) -> None:
+        total = len(self.scores.overlap_credit_list) + len(self.scores.left_credit_list) + len(self.scores.right_credit_list)
+        self.assertEqual(total, len(self.index))
+
+    def test_dropped_leading_token(self) -> None:
+        records = self.index.query(entity_type="ORG", match_type="right", credit=0.5, dropped_prefix="@")
+        self.assertEqual(1, len(records))
+        self.assertEqual("firefox", records[0].prediction.text)
+        self.assertEqual(0, records[0].sentence_id)
+        self.assertEqual(-1, records[0].length_difference)
+
+    def test_query_any_of(self) -> None:
+        records = self.index.query(match_type="overlap", credit=0.5, sentence_id=[0, 1])
+        self.assertEqual({"firefox", "Philips"}, {record.prediction.text for record in records})
+
+    def test_dropped_trailing_token(self) -> None:
+        records = self.index.query(match_type="left", dropped_suffix="AVENT")
+        self.assertEqual(1, len(records))
+        self.assertEqual(1, records[0].sentence_id)
+
+    def test_no_match(self) -> None:
+        self.assertEqual([], self.index.query(entity_type="LOC"))
+
+    def test_count(self) -> None:
+        self.assertEqual(len(self.index.query(credit=0.5)), self.index.count(credit=0.5))
+        self.assertEqual(0, self.index.count(entity_type="LOC"))
+
+    def test_add_after_query(self) -> None:
+        before = self.index.count(entity_type="ORG")
+        self.index.add(self.scores.build_index().records)
+        self.assertEqual(2 * before, self.index.count(entity_type="ORG"))
+
+    def test_save_load(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "index.pkl")
+            self.index.save(path)
+            loaded = MatchIndex.load(path)
+        self.assertEqual(self.index.query(match_type="right", dropped_prefix="@"), loaded.query(match_type="right", dropped_prefix="@"))
+
+    def test_unknown_field(self) -> None:
+        with self.assertRaises(ValueError):
+            self.index.query(colour="red")
+
+
+def synthetic_records(count: int) -> Iterator[MatchRecord]:
+    entity_types = ("ORG", "PER", "LOC")
+    for i in range(count):
+        entity_type = entity_types[i % 3]
+        word = f"w{i % 5000}"
+        gold = Mention(entity_type, 0, 2, f"@ {word}")
+        prediction = Mention(entity_type, i % 2, 2, word if i % 2 else f"@ {word}")
+        yield MatchRecord(("overlap", "left", "right")[i % 7 % 3], entity_type, 0.5 if i % 2 else 1.0, gold, prediction, i // 3)
+
+
+class TestMatchIndexScale(unittest.TestCase):
+    CONDITIONS = {"entity_type": "ORG", "match_type": "right", "credit": 0.5, "dropped_prefix": "@"}
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.index = MatchIndex(synthetic_records(1_000_000))
+        cls.index.count()
+
+    def best_seconds(self, method) -> float:
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            method(**self.CONDITIONS)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def test_query_and_count_on_a_million_records(self) -> None:
+        self.assertEqual(47619, self.index.count(**self.CONDITIONS))
+        self.assertEqual(47619, len(self.index.query(**self.CONDITIONS)))
+        # about 7 ms and 3 ms here, the bounds leave room for slower machines
+        self.assertLess(self.best_seconds(self.index.query), 0.05)
+        self.assertLess(self.best_seconds(self.index.count), 0.025)
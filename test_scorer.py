@@ -1,6 +1,8 @@
+import os
+import tempfile
 import unittest
 
-from scorer import Mention, Scorer
+from scorer import Mention, Scorer, ScorerCache
 
 
 class TestStrictEvaluation(unittest.TestCase):
@@ -122,4 +124,119 @@ class TestMerge(unittest.TestCase):
         predictions = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 3, 5, "said San")]
         scores = Scorer([], [])
         scores.merge(Scorer(reference, predictions))
-        self.assertAlmostEqual(2/5, scores.f1_score())
\ No newline at end of file
+        self.assertAlmostEqual(2/5, scores.f1_score())
+
+
+class TestScorerCache(unittest.TestCase):
+    def test_repeated_sentences_hit(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta")]
+        predictions = [Mention("PER", 1, 2, "Iverson")]
+        cache = ScorerCache()
+        cached = Scorer([], [])
+        uncached = Scorer([], [])
+        for sentence_id in range(3):
+            cached.merge(cache.score(reference, predictions), sentence_id=sentence_id)
+            uncached.merge(Scorer(reference, predictions, sentence_id=sentence_id))
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(1, cache.misses)
+        self.assertAlmostEqual(2/3, cache.hit_rate())
+        self.assertEqual(uncached.get_score_dict(), cached.get_score_dict())
+        self.assertEqual(uncached.credit_sentence_ids, cached.credit_sentence_ids)
+
+    def test_bounded(self) -> None:
+        cache = ScorerCache(maxsize=1)
+        first = [Mention("PER", 0, 1, "Allen")]
+        second = [Mention("ORG", 0, 1, "Meta")]
+        cache.score(first, first)
+        cache.score(second, second)
+        cache.score(first, first)
+        self.assertEqual(1, len(cache.cache))
+        self.assertEqual(0, cache.hits)
+
+
+class TestMetricFamilies(unittest.TestCase):
+    def test_selected_families(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta"), Mention("LOC", 4, 6, "San Francisco")]
+        predictions = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 3, 5, "said San")]
+        scores = Scorer(reference, predictions, families=["exact"])
+        self.assertEqual({"exact"}, scores.families)
+        self.assertEqual([], scores.overlap_credit_list)
+        self.assertEqual(['Exact Match'], scores.get_score_dict()['Metric'])
+        self.assertAlmostEqual(2/5, scores.f1_score())
+
+    def test_lazy_family(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta"), Mention("LOC", 4, 6, "San Francisco")]
+        prediction = [Mention("PER", 0, 2, "Allen Iverson"), Mention("LOC", 5, 6, "Francisco")]
+        scores = Scorer(reference, prediction, families=())
+        self.assertEqual(set(), scores.families)
+        self.assertAlmostEqual(0.6, scores.partial_match_f1())
+        self.assertEqual({"overlap"}, scores.families)
+
+    def test_merge_computes_needed_families(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta"), Mention("LOC", 4, 6, "San Francisco")]
+        prediction = [Mention("PER", 0, 1, "Allen"), Mention("LOC", 3, 5, "said San")]
+        scores = Scorer([], [], families=["left"])
+        other = Scorer(reference, prediction, families=())
+        scores.merge(other)
+        self.assertEqual({"left"}, other.families)
+        self.assertAlmostEqual(0.2, scores.left_match_f1())
+        self.assertEqual(['Left Boundary'], scores.get_score_dict()['Metric'])
+
+    def test_merge_drops_missing_family(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson")]
+        predictions = [Mention("PER", 0, 2, "Allen Iverson")]
+        narrow = Scorer([], [], families=["exact"])
+        narrow.merge(Scorer(reference, predictions))
+        scores = Scorer([], [])
+        scores.merge(narrow)
+        self.assertEqual({"exact"}, scores.families)
+        with self.assertRaises(ValueError):
+            scores.partial_match_f1()
+
+    def test_narrow_merge_skips_other_families(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta")]
+        predictions = [Mention("PER", 1, 2, "Iverson"), Mention("ORG", 2, 3, "Meta")]
+        scores = Scorer([], [], families=["exact"])
+        scores.merge(Scorer(reference, predictions))
+        self.assertEqual([], scores.overlap_credit_list)
+        self.assertEqual([], scores.left_credit_list)
+        self.assertEqual([], scores.right_credit_list)
+        self.assertEqual(0, sum(scores.credit_histogram.values()))
+        self.assertEqual(0, scores.partial_match_tp)
+
+    def test_dropped_family_is_cleared(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson")]
+        predictions = [Mention("PER", 1, 2, "Iverson")]
+        scores = Scorer([], [])
+        scores.merge(Scorer(reference, predictions))
+        narrow = Scorer([], [], families=["exact"])
+        narrow.merge(Scorer(reference, predictions))
+        scores.merge(narrow)
+        self.assertEqual({"exact"}, scores.families)
+        self.assertEqual([], scores.right_credit_list)
+        self.assertEqual([], scores.credit_sentence_ids["right"])
+        self.assertEqual(0, sum(scores.credit_histogram.values()))
+
+    def test_lazy_write_partial_matches(self) -> None:
+        reference = [Mention("PER", 0, 2, "Allen Iverson")]
+        predictions = [Mention("PER", 1, 2, "Iverson")]
+        scores = Scorer(reference, predictions, families=())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "overlap.csv")
+            scores.write_partial_matches(path, match_type="overlap")
+            with open(path, encoding="utf8") as file:
+                lines = file.read().splitlines()
+        self.assertEqual(["gold, prediction, credit", "Allen Iverson,Iverson,0.5"], lines)
+
+    def test_write_missing_family_keeps_file(self) -> None:
+        narrow = Scorer([], [], families=["exact"])
+        narrow.merge(Scorer([Mention("PER", 0, 2, "Allen Iverson")], [Mention("PER", 1, 2, "Iverson")]))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "overlap.csv")
+            with self.assertRaises(ValueError):
+                narrow.write_partial_matches(path, match_type="overlap")
+            self.assertFalse(os.path.exists(path))
+
+    def test_unknown_family(self) -> None:
+        with self.assertRaises(ValueError):
+            Scorer([], [], families=["token"])
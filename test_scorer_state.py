@@ -0,0 +1,153 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from scorer import Mention, Scorer
+from scorer_state import (dump_state, load_state, mentions_from_tags, merge_states, read_state, save_state, score_dump,
+                          tags_from_mentions, write_dump)
+
+
+def example_scorer() -> Scorer:
+    scores = Scorer([], [])
+    reference = [Mention("PER", 0, 2, "Allen Iverson"), Mention("ORG", 2, 3, "Meta"), Mention("LOC", 4, 6, "San Francisco")]
+    predictions = [Mention("PER", 0, 2, "Allen Iverson"), Mention("LOC", 3, 5, "said San")]
+    scores.merge(Scorer(reference, predictions, sentence_id=0))
+    reference_two = [Mention("ORG", 0, 2, "@ firefox")]
+    predictions_two = [Mention("ORG", 1, 2, "firefox")]
+    scores.merge(Scorer(reference_two, predictions_two, sentence_id=1))
+    return scores
+
+
+class TestSerialization(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        scores = example_scorer()
+        loaded = load_state(dump_state(scores))
+        self.assertEqual(scores.get_score_dict(), loaded.get_score_dict())
+        self.assertEqual(scores.credit_lists(), loaded.credit_lists())
+        self.assertEqual(scores.credit_sentence_ids, loaded.credit_sentence_ids)
+        self.assertEqual(scores.credit_histogram, loaded.credit_histogram)
+
+    def test_counters_only(self) -> None:
+        scores = example_scorer()
+        loaded = load_state(dump_state(scores, include_histogram=False, include_records=False))
+        self.assertEqual(scores.get_score_dict(), loaded.get_score_dict())
+        self.assertEqual([], loaded.overlap_credit_list)
+
+    def test_without_histogram(self) -> None:
+        loaded = load_state(dump_state(example_scorer(), include_histogram=False))
+        self.assertFalse(loaded.has_histogram)
+        with self.assertRaises(ValueError):
+            loaded.partial_credit_ratio()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            loaded.print_score_report()
+        self.assertIn("Percent given partial credit: n/a", output.getvalue())
+
+    def test_merge_with_missing_histogram(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, "full.bin"), os.path.join(directory, "counters.bin")]
+            save_state(example_scorer(), paths[0])
+            save_state(example_scorer(), paths[1], include_histogram=False)
+            merged = merge_states(paths)
+        self.assertFalse(merged.has_histogram)
+        self.assertEqual(0, sum(merged.credit_histogram.values()))
+        with self.assertRaises(ValueError):
+            merged.partial_credit_ratio()
+        # the incomplete histogram is not written back out as if it were whole
+        self.assertFalse(load_state(dump_state(merged)).has_histogram)
+
+    def test_histogram_without_records(self) -> None:
+        scores = example_scorer()
+        loaded = load_state(dump_state(scores, include_records=False))
+        self.assertAlmostEqual(scores.partial_credit_ratio(), loaded.partial_credit_ratio())
+
+    def test_merge_loaded_states(self) -> None:
+        scores = example_scorer()
+        merged = load_state(dump_state(example_scorer()))
+        merged.merge(load_state(dump_state(example_scorer())))
+        scores.merge(example_scorer())
+        self.assertEqual(scores.get_score_dict(), merged.get_score_dict())
+        self.assertEqual(scores.credit_histogram, merged.credit_histogram)
+
+    def test_families_round_trip(self) -> None:
+        scores = Scorer([], [], families=["exact", "overlap"])
+        scores.merge(example_scorer())
+        loaded = load_state(dump_state(scores))
+        self.assertEqual({"exact", "overlap"}, loaded.families)
+        self.assertEqual(scores.get_score_dict(), loaded.get_score_dict())
+
+    def test_bad_version(self) -> None:
+        data = bytearray(dump_state(example_scorer()))
+        data[4] = 99
+        with self.assertRaises(ValueError):
+            load_state(bytes(data))
+
+
+class TestTags(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        tokens = ["@", "firefox", "in", "San", "Francisco"]
+        tags = ["B-ORG", "I-ORG", "O", "B-LOC", "I-LOC"]
+        mentions = mentions_from_tags(tokens, tags)
+        self.assertEqual([Mention("ORG", 0, 2, "@ firefox"), Mention("LOC", 3, 5, "San Francisco")], mentions)
+        self.assertEqual(tags, tags_from_mentions(len(tokens), mentions))
+
+    def test_adjacent_mentions(self) -> None:
+        mentions = mentions_from_tags(["Meta", "Google"], ["B-ORG", "B-ORG"])
+        self.assertEqual([Mention("ORG", 0, 1, "Meta"), Mention("ORG", 1, 2, "Google")], mentions)
+
+
+class TestShardedScoring(unittest.TestCase):
+    def test_repeated_sentences_hit_cache(self) -> None:
+        tokens = ["Allen", "Iverson", "joined", "@", "Meta"]
+        gold = ["B-PER", "I-PER", "O", "B-ORG", "I-ORG"]
+        pred = ["B-PER", "I-PER", "O", "O", "B-ORG"]
+        with tempfile.TemporaryDirectory() as directory:
+            dump = os.path.join(directory, "dump.tsv")
+            write_dump(dump, [(None, tokens, gold, pred)] * 4)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                scores = score_dump(dump)
+        self.assertIn("Scorer cache: 3 hits, 1 misses, hit rate 75.00%", output.getvalue())
+        self.assertEqual([0, 1, 2, 3], sorted(set(scores.credit_sentence_ids["overlap"])))
+
+    def test_shard_score_merge(self) -> None:
+        sentences = []
+        for i in range(6):
+            tokens = ["Allen", "Iverson", "joined", "@", "Meta"]
+            gold = ["B-PER", "I-PER", "O", "B-ORG", "I-ORG"]
+            pred = ["B-PER", "I-PER", "O", "O", "B-ORG"] if i % 2 else gold
+            sentences.append((None, tokens, gold, pred))
+
+        with tempfile.TemporaryDirectory() as directory:
+            dump = os.path.join(directory, "dump.tsv")
+            write_dump(dump, sentences)
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scorer_state.py")
+
+            def run(*args: str) -> subprocess.Popen:
+                return subprocess.Popen([sys.executable, script, *args], stdout=subprocess.PIPE, text=True)
+
+            shard = run("shard", dump, "--shards", "3", "--output-dir", os.path.join(directory, "shards"))
+            shards = shard.communicate()[0].split()
+            self.assertEqual(0, shard.returncode)
+
+            # each shard is scored by its own process, standing in for a node
+            states = [os.path.join(directory, f"state-{i}.bin") for i in range(len(shards))]
+            workers = [run("score", shard_path, "--output", state) for shard_path, state in zip(shards, states)]
+            for worker in workers:
+                output = worker.communicate()[0]
+                self.assertEqual(0, worker.returncode)
+                self.assertIn("Scorer cache: 0 hits, 2 misses", output)
+
+            merged_path = os.path.join(directory, "merged.bin")
+            reducer = run("merge", *states, "--output", merged_path)
+            reducer.communicate()
+            self.assertEqual(0, reducer.returncode)
+
+            expected = score_dump(dump)
+            merged = read_state(merged_path)
+            self.assertEqual(expected.get_score_dict(), merged.get_score_dict())
+            self.assertEqual(sorted(expected.credit_sentence_ids["overlap"]), sorted(merged.credit_sentence_ids["overlap"]))
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest import mock
+
+import flair
+from flair.trainers.plugins.base import TrainingInterrupt
+
+import train
+from scorer import Mention, Scorer
+from train import PartialF1EarlyStopping, run_sweep
+
+
+class StubEarlyStopping(PartialF1EarlyStopping):
+    """
+    Early stopping whose dev scores come from a fixed list instead of a model.
+    """
+
+    def __init__(self, scores: List[Scorer], leaderboard: Dict, **kwargs) -> None:
+        super().__init__("stub", SimpleNamespace(dev=[]), leaderboard, threading.Lock(), [], **kwargs)
+        self.scores = iter(scores)
+
+    def score_dev(self) -> Scorer:
+        return next(self.scores)
+
+
+def dev_scores(correct: int, total: int = 4) -> Scorer:
+    gold = [Mention("PER", i, i + 1, "Iverson") for i in range(total)]
+    return Scorer(gold, gold[:correct], families=("exact", "overlap"))
+
+
+class TestPartialF1EarlyStopping(unittest.TestCase):
+    def test_records_best_per_epoch(self) -> None:
+        leaderboard = {1: 0.5}
+        plugin = StubEarlyStopping([dev_scores(4), dev_scores(1)], leaderboard, warmup_epochs=3)
+        plugin.after_training_epoch(epoch=1)
+        plugin.after_training_epoch(epoch=2)
+        self.assertEqual({1: 1.0, 2: dev_scores(1).partial_match_f1()}, leaderboard)
+        self.assertEqual([1, 2], [row['epoch'] for row in plugin.history])
+        self.assertFalse(plugin.stopped_early)
+
+    def test_no_stop_during_warmup(self) -> None:
+        plugin = StubEarlyStopping([dev_scores(1)], {1: 1.0}, warmup_epochs=3)
+        plugin.after_training_epoch(epoch=1)
+        self.assertFalse(plugin.stopped_early)
+
+    def test_stops_behind_best(self) -> None:
+        leaderboard = {3: 1.0}
+        plugin = StubEarlyStopping([dev_scores(3)], leaderboard, margin=0.02, warmup_epochs=3)
+        with self.assertRaises(TrainingInterrupt):
+            plugin.after_training_epoch(epoch=3)
+        self.assertTrue(plugin.stopped_early)
+        self.assertEqual(1.0, leaderboard[3])
+
+    def test_within_margin_continues(self) -> None:
+        partial_f1 = dev_scores(3).partial_match_f1()
+        plugin = StubEarlyStopping([dev_scores(3)], {3: partial_f1 + 0.01}, margin=0.02, warmup_epochs=3)
+        plugin.after_training_epoch(epoch=3)
+        self.assertFalse(plugin.stopped_early)
+
+
+def stub_train_config(config: Dict, leaderboard: Dict, lock, output_dir: str, store_path=None) -> Dict:
+    with lock:
+        leaderboard[config['learning_rate']] = config['partial_f1']
+    return {
+        'run': f"lr-{config['learning_rate']}",
+        **config,
+        'best_partial_f1': config['partial_f1'],
+        'leaderboard_size': len(leaderboard),
+        'device': str(flair.device),
+        'dev_sentences': len(train._worker_corpus.dev)
+    }
+
+
+def write_corpus(data_folder: str) -> None:
+    sentence = "Allen\tB-PER\nIverson\tI-PER\njoined\tO\n@\tB-ORG\nMeta\tI-ORG\n\n"
+    for split, size in (("train", 4), ("dev", 2), ("test", 2)):
+        with open(os.path.join(data_folder, f"{split}.txt"), mode="w", encoding="utf8") as file:
+            file.write(sentence * size)
+
+
+class TestRunSweep(unittest.TestCase):
+    def test_summary(self) -> None:
+        configs = [{'learning_rate': lr, 'partial_f1': f1} for lr, f1 in ((0.1, 0.6), (0.01, 0.8), (0.001, 0.7))]
+        with tempfile.TemporaryDirectory() as directory:
+            write_corpus(directory)
+            # workers are spawned, so they resolve the stub by name instead of inheriting a patch
+            with mock.patch.object(train, "train_config", stub_train_config):
+                summary = run_sweep(configs, workers=2, threads_per_worker=1,
+                                    output_dir=os.path.join(directory, "models"), data_folder=directory)
+            self.assertTrue(os.path.isfile(os.path.join(directory, "models", "sweep_summary.csv")))
+
+        self.assertEqual(["lr-0.01", "lr-0.001", "lr-0.1"], list(summary['run']))
+        self.assertEqual([0.8, 0.7, 0.6], list(summary['best_partial_f1']))
+        # the last run to finish sees every entry of the shared leaderboard
+        self.assertEqual(3, summary['leaderboard_size'].max())
+        # each worker loaded the corpus in its initializer and runs on the CPU
+        self.assertEqual([2, 2, 2], list(summary['dev_sentences']))
+        self.assertEqual({"cpu"}, set(summary['device']))
@@ -0,0 +1,215 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+import torch
+
+import flair
+from flair.data import Corpus
+from flair.datasets import ColumnCorpus
+from flair.embeddings import WordEmbeddings, FlairEmbeddings, StackedEmbeddings, TokenEmbeddings
+from flair.models import SequenceTagger
+from flair.trainers import ModelTrainer
+from flair.trainers.plugins import TrainerPlugin
+from flair.trainers.plugins.base import TrainingInterrupt
+
+from embedding_store import PrecomputedEmbeddings, precompute_corpus
+from scorer import Scorer
+
+
+DATA_FOLDER = "broad_twitter_corpus"
+COLUMNS = {0: 'text', 1: 'ner'}
+LABEL_TYPE = 'ner'
+
+
+def load_corpus(data_folder: str = DATA_FOLDER) -> Corpus:
+    """
+    Loads the corrected Broad Twitter Corpus splits.
+    """
+    return ColumnCorpus(data_folder, COLUMNS,
+                        train_file='train.txt',
+                        test_file='test.txt',
+                        dev_file='dev.txt',
+                        column_delimiter='\t')
+
+
+def build_embeddings(store_path: Optional[str] = None) -> TokenEmbeddings:
+    """
+    The frozen embedding stack used by every model, served from the precomputed store if given.
+    """
+    embedding_types = [
+        WordEmbeddings('twitter'),
+        FlairEmbeddings('news-forward'),
+        FlairEmbeddings('news-backward')
+    ]
+    embeddings = StackedEmbeddings(embeddings=embedding_types)
+    if store_path is not None:
+        embeddings = PrecomputedEmbeddings(embeddings, store_path)
+    return embeddings
+
+
+class PartialF1EarlyStopping(TrainerPlugin):
+    """
+    Scores dev with Scorer after each epoch and stops the run once its partial F1
+    falls more than `margin` behind the best run of the sweep at the same epoch.
+    """
+
+    def __init__(self, run_name: str, corpus: Corpus, leaderboard: Dict, lock, history: List,
+                 margin: float = 0.02, warmup_epochs: int = 3, batch_size: int = 32) -> None:
+        super().__init__()
+        self.run_name = run_name
+        self.dev = list(corpus.dev)
+        self.gold = [Scorer.create_mentions(sentence.get_labels(LABEL_TYPE)) for sentence in self.dev]
+        self.leaderboard = leaderboard
+        self.lock = lock
+        self.history = history
+        self.margin = margin
+        self.warmup_epochs = warmup_epochs
+        self.batch_size = batch_size
+        self.stopped_early = False
+
+    def score_dev(self) -> Scorer:
+        # predict under a separate label name so the gold labels stay untouched
+        self.model.eval()
+        self.model.predict(self.dev, mini_batch_size=self.batch_size, label_name="sweep")
+        self.model.train()
+        # only exact and overlap are read, so skip the left/right boundary matching
+        scores = Scorer([], [], families=("exact", "overlap"))
+        for gold, sentence in zip(self.gold, self.dev):
+            scores.merge(Scorer(gold, Scorer.create_mentions(sentence.get_labels("sweep")), families=()))
+            sentence.remove_labels("sweep")
+        return scores
+
+    @TrainerPlugin.hook
+    def after_training_epoch(self, epoch: int, **kw) -> None:
+        scores = self.score_dev()
+        partial_f1 = scores.partial_match_f1()
+        self.history.append({'epoch': epoch, 'exact_f1': scores.f1_score(), 'partial_f1': partial_f1})
+
+        # read-modify-write of the shared leaderboard, other workers update the same epoch
+        with self.lock:
+            best = max(self.leaderboard.get(epoch, 0.0), partial_f1)
+            self.leaderboard[epoch] = best
+        if epoch >= self.warmup_epochs and partial_f1 < best - self.margin:
+            self.stopped_early = True
+            raise TrainingInterrupt(f"{self.run_name}: dev partial F1 {partial_f1:0.4f} behind best {best:0.4f}")
+
+
+_worker_corpus: Optional[Corpus] = None
+
+
+def _init_worker(cores, threads_per_worker: int, data_folder: str) -> None:
+    """
+    Pins each worker process to its own slice of cores and torch thread count, on the CPU.
+    """
+    global _worker_corpus
+    flair.device = torch.device("cpu")
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores.get())
+    torch.set_num_threads(threads_per_worker)
+    torch.set_num_interop_threads(1)
+    _worker_corpus = load_corpus(data_folder)
+
+
+def train_config(config: Dict, leaderboard: Dict, lock, output_dir: str, store_path: Optional[str] = None) -> Dict:
+    """
+    Trains one configuration of the sweep and summarizes its dev scores.
+    """
+    corpus = _worker_corpus if _worker_corpus is not None else load_corpus()
+    label_dict = corpus.make_label_dictionary(label_type=LABEL_TYPE, add_unk=False)
+
+    tagger = SequenceTagger(hidden_size=config.get('hidden_size', 256),
+                            embeddings=build_embeddings(store_path),
+                            tag_dictionary=label_dict,
+                            tag_type=LABEL_TYPE,
+                            tag_format="BIO")
+
+    run_name = f"lr-{config['learning_rate']}"
+    history: List[Dict] = []
+    plugin = PartialF1EarlyStopping(run_name, corpus, leaderboard, lock, history,
+                                    margin=config.get('margin', 0.02),
+                                    warmup_epochs=config.get('warmup_epochs', 3))
+
+    path = os.path.join(output_dir, f"model-{run_name}")
+    trainer = ModelTrainer(tagger, corpus)
+    trainer.train(path,
+                  learning_rate=config['learning_rate'],
+                  mini_batch_size=config.get('mini_batch_size', 32),
+                  max_epochs=config.get('max_epochs', 25),
+                  plugins=[plugin])
+
+    best = max(history, key=lambda row: row['partial_f1'], default={'epoch': 0, 'exact_f1': 0.0, 'partial_f1': 0.0})
+    return {
+        'run': run_name,
+        **config,
+        'epochs_run': len(history),
+        'stopped_early': plugin.stopped_early,
+        'best_epoch': best['epoch'],
+        'best_exact_f1': best['exact_f1'],
+        'best_partial_f1': best['partial_f1'],
+        'path': path
+    }
+
+
+def run_sweep(configs: Sequence[Dict], workers: int = 2, threads_per_worker: Optional[int] = None,
+              output_dir: str = "models", store_path: Optional[str] = None,
+              data_folder: str = DATA_FOLDER) -> pd.DataFrame:
+    """
+    Trains the configurations across CPU worker processes and collects one summary table.
+    """
+    cpu_count = os.cpu_count() or 1
+    if threads_per_worker is None:
+        threads_per_worker = max(1, cpu_count // workers)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # spawned rather than forked, a forked child cannot use CUDA once the parent has initialized it
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        leaderboard = manager.dict()
+        lock = manager.Lock()
+        cores = None
+        if hasattr(os, "sched_setaffinity"):
+            cores = manager.Queue()
+            for i in range(workers):
+                start = (i * threads_per_worker) % cpu_count
+                cores.put({(start + j) % cpu_count for j in range(threads_per_worker)})
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(cores, threads_per_worker, data_folder)) as executor:
+            futures = [executor.submit(train_config, config, leaderboard, lock, output_dir, store_path) for config in configs]
+            results = [future.result() for future in futures]
+
+    summary = pd.DataFrame(results).sort_values('best_partial_f1', ascending=False)
+    summary.to_csv(os.path.join(output_dir, "sweep_summary.csv"), index=False)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learning rate sweep for the BiLSTM-CRF tagger.")
+    parser.add_argument("--learning-rates", type=float, nargs="+", default=[0.05, 0.01, 0.005, 0.0025, 0.001])
+    parser.add_argument("--max-epochs", type=int, default=25)
+    parser.add_argument("--mini-batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--margin", type=float, default=0.02, help="partial F1 gap to the best run that stops a run")
+    parser.add_argument("--warmup-epochs", type=int, default=3)
+    parser.add_argument("--output-dir", default="models")
+    parser.add_argument("--embedding-store", default="embeddings", help="precomputed embedding store, built if missing")
+    args = parser.parse_args()
+
+    # embed the corpus once up front so no worker runs the language models
+    if args.embedding_store and not os.path.isdir(args.embedding_store):
+        precompute_corpus(load_corpus(), build_embeddings(), path=args.embedding_store)
+
+    configs = [{'learning_rate': lr,
+                'max_epochs': args.max_epochs,
+                'mini_batch_size': args.mini_batch_size,
+                'margin': args.margin,
+                'warmup_epochs': args.warmup_epochs} for lr in args.learning_rates]
+
+    summary = run_sweep(configs, workers=args.workers, threads_per_worker=args.threads_per_worker,
+                        output_dir=args.output_dir, store_path=args.embedding_store)
+    print(summary.to_string(index=False))